@@ -1,49 +1,207 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import LargeBinary
+from sqlalchemy import LargeBinary, column, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from flask_migrate import Migrate
 from flask_cors import CORS
 from waitress import serve
-from flask import send_file
-import io
+from urllib.parse import quote
+import hashlib
 import os
-import json
+import threading
+import unicodedata
+import orjson
+
+# Serve and parse JSON with orjson instead of the stdlib json module
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-CORS(app, methods=['GET', 'POST', 'DELETE'])  # Allow React frontend requests
+app.json = OrjsonProvider(app)
+# Allow React frontend requests; X-Has-More tells it that /getfiles has another page
+CORS(app, methods=['GET', 'POST', 'DELETE'], expose_headers=['X-Has-More'])
 
 # Config from environment
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool sized for Waitress worker threads (threads <= pool_size + max_overflow)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 25))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 25))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+}
+
+# Size of the slices streamed back by /downloadfile and read from uploads
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Upper bound on the number of files returned by a single /getfiles call
+MAX_FILES_PAGE_SIZE = 200
+
+# Limits on the 'tags' form field of /addfile and /updatefile
+MAX_TAGS_JSON_LENGTH = 8192
+MAX_TAGS = 50
+MAX_TAG_LENGTH = 50  # matches Tag.tag column size
+
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
 # Association table for many-to-many MidiFile <-> Tag
 file_tag = db.Table('file_tag',
     db.Column('file_id', db.Integer, db.ForeignKey('midi_file.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Index('file_tag_tag_file', 'tag_id', 'file_id')  # lookups by tag for /getfiles filters
 )
 
 class MidiFile(db.Model):
     __tablename__ = 'midi_file'
+    __table_args__ = (
+        # Trigram index so ilike('%term%') searches don't scan the whole table
+        db.Index('midi_file_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
-    file_data = db.Column(LargeBinary, nullable=False)  # binary midi data stored here
     description = db.Column(db.Text)
-    tags = db.relationship('Tag', secondary=file_tag, backref='files')
+    tags = db.relationship('Tag', secondary=file_tag, back_populates='files')
+    # Binary data lives in midi_blob; never loaded with the metadata, removed by ON DELETE CASCADE
+    blob = db.relationship('MidiBlob', uselist=False, lazy='noload', passive_deletes=True)
+
+class MidiBlob(db.Model):
+    __tablename__ = 'midi_blob'
+    file_id = db.Column(db.Integer, db.ForeignKey('midi_file.id', ondelete='CASCADE'), primary_key=True)
+    data = db.Column(LargeBinary, nullable=False)  # binary midi data stored here
 
 class Tag(db.Model):
     __tablename__ = 'tag'
     id = db.Column(db.Integer, primary_key=True)
     tag = db.Column(db.String(50), unique=True, nullable=False)
+    # Never load implicitly; reading tag.files must go through an explicit query
+    files = db.relationship('MidiFile', secondary=file_tag, back_populates='tags', lazy='raise')
+
+# Tags are unique regardless of casing; the first spelling used is kept for display
+db.Index('tag_lower', func.lower(Tag.tag), unique=True)
+
+# Read an uploaded file into a bytearray chunk by chunk and return a memoryview over it,
+# which psycopg2's Binary adapts through the buffer protocol without another copy
+def read_upload(file):
+    buf = bytearray()
+    while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+        buf += chunk
+    return memoryview(buf)
+
+# Content-hash ETag for a serialized JSON body
+def make_etag(body):
+    return hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+
+# JSON response tagged with an ETag, or an empty 304 if the client already has it
+def etag_response(body, etag):
+    # If-None-Match uses weak comparison (RFC 9110), so W/"..." from a proxy still matches
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+# Parse the 'tags' form field into a bounded list of strings, raising ValueError otherwise
+def parse_tag_names(tags_json):
+    if len(tags_json) > MAX_TAGS_JSON_LENGTH:
+        raise ValueError("Tags payload too large")
+    tag_names = orjson.loads(tags_json)
+    if not isinstance(tag_names, list) or len(tag_names) > MAX_TAGS:
+        raise ValueError("Tags must be a list of at most %d names" % MAX_TAGS)
+    # Length is checked on the stripped name, which is what ends up in the column;
+    # MAX_TAGS_JSON_LENGTH above already bounds the raw payload
+    if not all(isinstance(t, str) and len(t.strip()) <= MAX_TAG_LENGTH for t in tag_names):
+        raise ValueError("Each tag must be a string of at most %d characters" % MAX_TAG_LENGTH)
+    return tag_names
+
+# Map each of the given names to the existing tag it matches, keyed by the name as given.
+# Matching uses the database's lower() so it always agrees with the tag_lower unique index.
+def find_tags(names):
+    wanted = values(column('name', db.String), name='wanted').data([(n,) for n in names])
+    rows = db.session.execute(
+        select(wanted.c.name, Tag).join(Tag, func.lower(Tag.tag) == func.lower(wanted.c.name))
+    )
+    return dict(rows.all())
+
+# Turn raw tag names into Tag rows, creating missing ones in a single upsert.
+# Returns (tags, created) where created tells whether any new tag was inserted.
+# Raises ValueError if a name can't be matched to a tag.
+def resolve_tags(raw_names):
+    # Remove duplicates in a case-insensitive way, preserving original casing of first occurrence
+    seen = set()
+    unique_tag_names = []
+    for t in raw_names:
+        t_clean = t.strip()
+        if not t_clean:
+            continue
+        t_lower = t_clean.lower()
+        if t_lower not in seen:
+            seen.add(t_lower)
+            unique_tag_names.append(t_clean)
+
+    if not unique_tag_names:
+        return [], False
+
+    # Tag lookups don't depend on pending changes, so don't let them force a flush;
+    # everything pending goes out together at commit
+    with db.session.no_autoflush:
+        by_name = find_tags(unique_tag_names)
+        missing = [n for n in unique_tag_names if n not in by_name]
+        if missing:
+            # Insert all new tags in one statement; rows created concurrently (in any casing)
+            # hit the tag_lower unique index and are skipped. Rows go in a fixed order so two
+            # uploads creating the same tags lock the index entries in the same order and
+            # can't deadlock each other.
+            db.session.execute(
+                pg_insert(Tag).values([{'tag': n} for n in sorted(missing, key=str.lower)])
+                .on_conflict_do_nothing()
+            )
+            by_name.update(find_tags(missing))
+
+    if any(n not in by_name for n in unique_tag_names):
+        raise ValueError("Tags could not be resolved")
+
+    # Names Python's lower() kept apart can still fold to the same tag in the database
+    tags = list({by_name[n].id: by_name[n] for n in unique_tag_names}.values())
+    return tags, bool(missing)
+
+# Serialized /gettaglist response as a single immutable (body, etag) pair, cleared
+# whenever a new tag is committed. Each invalidation bumps the generation, so a fill
+# whose query may have run before the commit is never stored.
+_tag_cache = {'entry': None, 'generation': 0}
+_tag_cache_lock = threading.Lock()
+
+def invalidate_tag_cache():
+    with _tag_cache_lock:
+        _tag_cache['entry'] = None
+        _tag_cache['generation'] += 1
 
 # Endpoint to get list of tags
 @app.route('/gettaglist', methods=['GET'])
 def get_tag_list():
-    tags = Tag.query.all()
-    tag_list = [{'id': t.id, 'tag': t.tag} for t in tags]
-    return jsonify(tag_list)
+    entry = _tag_cache['entry']
+    if entry is None:
+        generation = _tag_cache['generation']
+        tags = Tag.query.all()
+        tag_list = [{'id': t.id, 'tag': t.tag} for t in tags]
+        body = app.json.dumps(tag_list)
+        entry = (body, make_etag(body))
+        with _tag_cache_lock:
+            if _tag_cache['generation'] == generation:
+                _tag_cache['entry'] = entry
+    body, etag = entry
+    return etag_response(body, etag)
 
 # Endpoint to add file
 @app.route('/addfile', methods=['POST'])
@@ -67,47 +225,35 @@ def add_file():
         return jsonify({'error': 'Name is required'}), 400
 
     try:
-        tag_names = json.loads(tags_json)
-        if not isinstance(tag_names, list):
-            raise ValueError("Tags must be a list of names")
+        tag_names = parse_tag_names(tags_json)
     except Exception:
         return jsonify({'error': 'Invalid tags format'}), 400
 
-    file_bytes = file.read()
-
-    # Remove duplicates in a case-insensitive way, preserving original casing of first occurrence
-    seen = set()
-    unique_tag_names = []
-    for t in tag_names:
-        t_clean = t.strip()
-        if not t_clean:
-            continue
-        t_lower = t_clean.lower()
-        if t_lower not in seen:
-            seen.add(t_lower)
-            unique_tag_names.append(t_clean)
+    file_bytes = read_upload(file)
 
     # Create the MidiFile instance
     midi_file = MidiFile(
         name=name,
-        file_data=file_bytes,
-        description=description
+        description=description,
+        blob=MidiBlob(data=file_bytes)
     )
 
-    # Process unique tag names into Tag objects (create if they don't exist)
-    tags = []
-    for tag_name in unique_tag_names:
-        tag = Tag.query.filter_by(tag=tag_name).first()
-        if not tag:
-            tag = Tag(tag=tag_name)
-            db.session.add(tag)
-            db.session.flush()
-        tags.append(tag)
-
-    midi_file.tags = tags
+    # Process tag names into Tag objects (create if they don't exist)
+    try:
+        tags, tags_created = resolve_tags(tag_names)
+    except ValueError:
+        return jsonify({'error': 'Invalid tags format'}), 400
 
     db.session.add(midi_file)
+    db.session.flush()  # assigns midi_file.id
+
+    # Link all tags with a single multi-row insert into the association table
+    if tags:
+        db.session.execute(file_tag.insert(), [{'file_id': midi_file.id, 'tag_id': t.id} for t in tags])
+
     db.session.commit()
+    if tags_created:
+        invalidate_tag_cache()
 
     return jsonify({'message': 'File added successfully', 'id': midi_file.id})
 
@@ -122,28 +268,58 @@ def get_files():
     tag_ids = data.get('tags', [])
     search = data.get('search', '').strip()
 
-    query = MidiFile.query
-
-    # Require all selected tags (logical AND)
-    for tag_id in tag_ids:
-        query = query.filter(MidiFile.tags.any(Tag.id == tag_id))
+    # Page bounds must be real integers (bool is an int subclass, so exclude it explicitly)
+    limit = data.get('limit', MAX_FILES_PAGE_SIZE)
+    offset = data.get('offset', 0)
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (limit, offset)) \
+            or limit < 1 or offset < 0:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+    limit = min(limit, MAX_FILES_PAGE_SIZE)
+
+    # Plain Core rows; no ORM objects are needed just to serialize three columns
+    query = select(MidiFile.id, MidiFile.name, MidiFile.description)
+
+    # Require all selected tags (logical AND) with a single join + aggregate
+    tag_ids = list(set(tag_ids))
+    if tag_ids:
+        query = (
+            query.join(file_tag, file_tag.c.file_id == MidiFile.id)
+            .where(file_tag.c.tag_id.in_(tag_ids))
+            .group_by(MidiFile.id)
+            .having(func.count(func.distinct(file_tag.c.tag_id)) == len(tag_ids))
+        )
 
     if search:
-        query = query.filter(MidiFile.name.ilike(f'%{search}%'))
-
-    files = query.all()
+        # Escape LIKE wildcards so user input is matched literally (served by the trigram index)
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.where(MidiFile.name.ilike(f'%{pattern}%', escape='\\'))
+
+    # Fetch one extra row to learn whether another page follows
+    query = query.order_by(MidiFile.id).limit(limit + 1).offset(offset)
+    files = db.session.execute(query).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+
+    # Load tag names for all matched files in one query
+    tags_by_file = {f.id: [] for f in files}
+    if tags_by_file:
+        tag_rows = db.session.execute(
+            select(file_tag.c.file_id, Tag.tag)
+            .join(Tag, Tag.id == file_tag.c.tag_id)
+            .where(file_tag.c.file_id.in_(list(tags_by_file)))
+        )
+        for file_id, tag in tag_rows:
+            tags_by_file[file_id].append(tag)
 
     # Serialize response with tags as list of tag names only
-    result = []
-    for f in files:
-        result.append({
-            'id': f.id,
-            'name': f.name,
-            'description': f.description,
-            'tags': [t.tag for t in f.tags]  # just tag names
-        })
+    result = [
+        {'id': f.id, 'name': f.name, 'description': f.description, 'tags': tags_by_file[f.id]}
+        for f in files
+    ]
 
-    return jsonify(result)
+    response = jsonify(result)
+    response.headers['X-Has-More'] = 'true' if has_more else 'false'
+    return response
 
 @app.route('/updatefile', methods=['POST'])
 def update_file():
@@ -151,6 +327,15 @@ def update_file():
     if not file_id:
         return jsonify({'error': 'File ID not provided'}), 400
 
+    # Read the new file data (if provided) before the first query, so the
+    # request doesn't hold a pooled DB connection while copying the upload
+    file_bytes = None
+    if 'file' in request.files:
+        file = request.files['file']
+        if not file.filename.lower().endswith(('.mid', '.midi')):
+            return jsonify({'error': 'File must be a MIDI (.mid/.midi)'}), 400
+        file_bytes = read_upload(file)
+
     midi_file = MidiFile.query.get(file_id)
     if not midi_file:
         return jsonify({'error': 'File not found'}), 404
@@ -166,44 +351,30 @@ def update_file():
 
     # Parse tags
     try:
-        tag_names = json.loads(tags_json)
-        if not isinstance(tag_names, list):
-            raise ValueError("Tags must be a list of names")
+        tag_names = parse_tag_names(tags_json)
     except Exception:
         return jsonify({'error': 'Invalid tags format'}), 400
 
-    # Sanitize and deduplicate tags
-    seen = set()
-    unique_tag_names = []
-    for t in tag_names:
-        t_clean = t.strip()
-        if not t_clean:
-            continue
-        t_lower = t_clean.lower()
-        if t_lower not in seen:
-            seen.add(t_lower)
-            unique_tag_names.append(t_clean)
-
     # Update tags
-    tags = []
-    for tag_name in unique_tag_names:
-        tag = Tag.query.filter_by(tag=tag_name).first()
-        if not tag:
-            tag = Tag(tag=tag_name)
-            db.session.add(tag)
-            db.session.flush()
-        tags.append(tag)
-    midi_file.tags = tags
+    try:
+        tags, tags_created = resolve_tags(tag_names)
+    except ValueError:
+        return jsonify({'error': 'Invalid tags format'}), 400
+
+    # Replace tag links directly instead of loading the old collection to diff it
+    db.session.execute(file_tag.delete().where(file_tag.c.file_id == midi_file.id))
+    if tags:
+        db.session.execute(file_tag.insert(), [{'file_id': midi_file.id, 'tag_id': t.id} for t in tags])
 
     # Update file data if provided
-    if 'file' in request.files:
-        file = request.files['file']
-        if file.filename.lower().endswith(('.mid', '.midi')):
-            midi_file.file_data = file.read()
-        else:
-            return jsonify({'error': 'File must be a MIDI (.mid/.midi)'}), 400
+    if file_bytes is not None:
+        db.session.execute(
+            update(MidiBlob).where(MidiBlob.file_id == midi_file.id).values(data=file_bytes)
+        )
 
     db.session.commit()
+    if tags_created:
+        invalidate_tag_cache()
     return jsonify({'message': 'File updated successfully'})
 
 
@@ -216,17 +387,34 @@ def download_file():
     if not file_id:
         return jsonify({'error': 'File ID not provided'}), 400
 
-    midi_file = MidiFile.query.get_or_404(file_id)
-
-    if not midi_file.file_data:
+    # Fetch name and blob in one query, without building ORM objects
+    row = db.session.execute(
+        select(MidiFile.name, MidiBlob.data)
+        .outerjoin(MidiBlob, MidiBlob.file_id == MidiFile.id)
+        .where(MidiFile.id == file_id)
+    ).first()
+    if row is None:
+        abort(404)
+
+    name, file_data = row
+    if not file_data:
         return jsonify({'error': 'No file data found'}), 404
 
-    return send_file(
-        io.BytesIO(midi_file.file_data),
-        mimetype='audio/midi',
-        as_attachment=True,
-        download_name=f"{midi_file.name or 'download'}.mid"
+    def generate():
+        view = memoryview(file_data)
+        for start in range(0, len(view), DOWNLOAD_CHUNK_SIZE):
+            yield bytes(view[start:start + DOWNLOAD_CHUNK_SIZE])
+
+    # Like send_file: a plain ASCII filename for old clients plus the RFC 5987 UTF-8 form
+    download_name = f"{name or 'download'}.mid"
+    ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    response = Response(generate(), mimetype='audio/midi')
+    response.headers.set(
+        'Content-Disposition', 'attachment',
+        filename=ascii_name, **{'filename*': "UTF-8''" + quote(download_name, safe='')}
     )
+    response.headers['Content-Length'] = str(len(file_data))
+    return response
 
 @app.route('/deletefile', methods=['POST'])
 def delete_file():
@@ -246,4 +434,9 @@ def delete_file():
 
 
 if __name__ == "__main__":
-    serve(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    serve(
+        app,
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 5000)),
+        threads=int(os.environ.get("WAITRESS_THREADS", DB_POOL_SIZE))
+    )
@@ -0,0 +1,33 @@
+"""Add trigram index on midi_file.name and (tag_id, file_id) index on file_tag
+
+Revision ID: 7c1f4a9e2b3d
+Revises: e3d56533fe7a
+Create Date: 2026-10-14 10:12:03.418251
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f4a9e2b3d'
+down_revision = 'e3d56533fe7a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.batch_alter_table('midi_file', schema=None) as batch_op:
+        batch_op.create_index('midi_file_name_trgm', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+    with op.batch_alter_table('file_tag', schema=None) as batch_op:
+        batch_op.create_index('file_tag_tag_file', ['tag_id', 'file_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('file_tag', schema=None) as batch_op:
+        batch_op.drop_index('file_tag_tag_file')
+
+    with op.batch_alter_table('midi_file', schema=None) as batch_op:
+        batch_op.drop_index('midi_file_name_trgm', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
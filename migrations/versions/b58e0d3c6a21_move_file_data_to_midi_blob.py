@@ -0,0 +1,41 @@
+"""Move file_data from midi_file into a separate midi_blob table
+
+Revision ID: b58e0d3c6a21
+Revises: 7c1f4a9e2b3d
+Create Date: 2026-10-14 11:47:26.905114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b58e0d3c6a21'
+down_revision = '7c1f4a9e2b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('midi_blob',
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['midi_file.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('file_id')
+    )
+    op.execute('INSERT INTO midi_blob (file_id, data) SELECT id, file_data FROM midi_file')
+
+    with op.batch_alter_table('midi_file', schema=None) as batch_op:
+        batch_op.drop_column('file_data')
+
+
+def downgrade():
+    with op.batch_alter_table('midi_file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('file_data', sa.LargeBinary(), nullable=True))
+
+    op.execute('UPDATE midi_file SET file_data = midi_blob.data FROM midi_blob WHERE midi_blob.file_id = midi_file.id')
+
+    with op.batch_alter_table('midi_file', schema=None) as batch_op:
+        batch_op.alter_column('file_data', existing_type=sa.LargeBinary(), nullable=False)
+
+    op.drop_table('midi_blob')
@@ -0,0 +1,46 @@
+"""Merge tags differing only by case and make tag uniqueness case-insensitive
+
+Revision ID: d2a7f6c81e40
+Revises: b58e0d3c6a21
+Create Date: 2026-10-14 14:05:51.662397
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7f6c81e40'
+down_revision = 'b58e0d3c6a21'
+branch_labels = None
+depends_on = None
+
+
+# For every lowercased tag name, the oldest row is the one that is kept
+CANONICAL_TAGS = 'SELECT lower(tag) AS tag_lower, min(id) AS keep_id FROM tag GROUP BY lower(tag)'
+
+
+def upgrade():
+    # Point files at the canonical tag, then drop the duplicate links and tags
+    op.execute(
+        'INSERT INTO file_tag (file_id, tag_id) '
+        'SELECT DISTINCT ft.file_id, c.keep_id FROM file_tag ft '
+        'JOIN tag t ON t.id = ft.tag_id '
+        f'JOIN ({CANONICAL_TAGS}) c ON c.tag_lower = lower(t.tag) '
+        'WHERE ft.tag_id <> c.keep_id '
+        'ON CONFLICT DO NOTHING'
+    )
+    op.execute(
+        f'DELETE FROM file_tag ft USING tag t, ({CANONICAL_TAGS}) c '
+        'WHERE t.id = ft.tag_id AND c.tag_lower = lower(t.tag) AND t.id <> c.keep_id'
+    )
+    op.execute(
+        f'DELETE FROM tag t USING ({CANONICAL_TAGS}) c '
+        'WHERE c.tag_lower = lower(t.tag) AND t.id <> c.keep_id'
+    )
+
+    op.create_index('tag_lower', 'tag', [sa.text('lower(tag)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('tag_lower', table_name='tag')
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+# The app relies on Postgres features (ON CONFLICT, lower() indexes), so the
+# tests need a real, disposable Postgres database: TEST_DATABASE_URL=postgresql://...
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+
+@pytest.fixture(scope='session')
+def backend():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    import app as backend
+
+    with backend.app.app_context():
+        try:
+            backend.db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            backend.db.session.commit()
+        except DBAPIError:
+            # Server without contrib modules: the search index is only an optimization
+            backend.db.session.rollback()
+            table = backend.MidiFile.__table__
+            table.indexes.discard(next(i for i in table.indexes if i.name == 'midi_file_name_trgm'))
+    return backend
+
+
+@pytest.fixture
+def app(backend):
+    with backend.app.app_context():
+        backend.db.drop_all()
+        backend.db.create_all()
+    backend.invalidate_tag_cache()
+    return backend.app
+
+
+# Records every SQL statement sent to the database while the test runs
+@pytest.fixture
+def statements(backend, app):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    with app.app_context():
+        engine = backend.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,220 @@
+import io
+import json
+
+from sqlalchemy import event, func, select
+
+MIDI_BYTES = b'MThd\x00\x00\x00\x06\x00\x01\x00\x01\x00\x60MTrk\x00\x00\x00\x04\x00\xff\x2f\x00'
+
+
+def add_file(client, name='Song', tags=(), data=MIDI_BYTES, filename='song.mid'):
+    return client.post('/addfile', data={
+        'name': name,
+        'description': f'{name} description',
+        'tags': json.dumps(list(tags)),
+        'file': (io.BytesIO(data), filename),
+    }, content_type='multipart/form-data')
+
+
+def get_files(client, **body):
+    return client.post('/getfiles', json={'tags': [], 'search': '', **body})
+
+
+def tag_ids(client):
+    return {t['tag']: t['id'] for t in client.get('/gettaglist').get_json()}
+
+
+def test_add_and_download_round_trip(client):
+    response = add_file(client, name='Čardaš', tags=['Folk'])
+    assert response.status_code == 200
+    file_id = response.get_json()['id']
+
+    download = client.post('/downloadfile', json={'id': file_id})
+    assert download.status_code == 200
+    assert download.mimetype == 'audio/midi'
+    assert download.data == MIDI_BYTES
+    assert download.headers['Content-Disposition'] == (
+        "attachment; filename=Cardas.mid; filename*=UTF-8''%C4%8Carda%C5%A1.mid"
+    )
+
+
+def test_download_name_is_quoted_safely(client):
+    file_id = add_file(client, name='AC/DC "Live"').get_json()['id']
+
+    download = client.post('/downloadfile', json={'id': file_id})
+    assert download.headers['Content-Disposition'] == (
+        'attachment; filename="AC/DC \\"Live\\".mid"; filename*=UTF-8\'\'AC%2FDC%20%22Live%22.mid'
+    )
+
+
+def test_add_rejects_non_midi(client):
+    assert add_file(client, filename='song.mp3').status_code == 400
+
+
+def test_update_replaces_blob_and_tags(client):
+    file_id = add_file(client, tags=['Rock', 'Live']).get_json()['id']
+
+    response = client.post('/updatefile', data={
+        'id': str(file_id),
+        'name': 'Renamed',
+        'tags': json.dumps(['live', 'Jazz']),
+        'file': (io.BytesIO(b'MThd new'), 'new.midi'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    [f] = get_files(client).get_json()
+    assert f['name'] == 'Renamed'
+    assert sorted(f['tags']) == ['Jazz', 'Live']
+    assert client.post('/downloadfile', json={'id': file_id}).data == b'MThd new'
+
+
+def test_delete_removes_blob(client, backend):
+    file_id = add_file(client).get_json()['id']
+    assert client.post('/deletefile', json={'id': file_id}).status_code == 200
+
+    with backend.app.app_context():
+        assert backend.db.session.execute(select(func.count()).select_from(backend.MidiBlob)).scalar() == 0
+
+
+def test_tags_are_deduplicated_case_insensitively(client):
+    add_file(client, tags=['Rock', ' rock ', 'ROCK', ''])
+    add_file(client, tags=['rOcK'])
+    assert list(tag_ids(client)) == ['Rock']
+
+
+def test_new_tags_are_inserted_in_a_fixed_order(client, backend):
+    inserted = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO tag'):
+            inserted.append(list(parameters.values()))
+
+    with backend.app.app_context():
+        engine = backend.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        add_file(client, tags=['beta', 'Alpha', 'gamma'])
+        add_file(client, tags=['zeta', 'Delta'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    # Concurrent uploads then lock tag_lower entries in the same order and can't deadlock
+    assert inserted == [['Alpha', 'beta', 'gamma'], ['Delta', 'zeta']]
+
+
+def test_invalid_tags_are_rejected(client):
+    assert add_file(client, tags=[1]).status_code == 400
+    assert add_file(client, tags=['x'] * 51).status_code == 400
+    assert add_file(client, tags=['x' * 51]).status_code == 400
+    assert add_file(client, tags=[' ' + 'x' * 51]).status_code == 400
+
+
+def test_tag_length_limit_applies_after_stripping(client):
+    assert add_file(client, tags=['  ' + 'x' * 50 + ' ']).status_code == 200
+    assert list(tag_ids(client)) == ['x' * 50]
+
+
+def test_getfiles_requires_all_selected_tags(client):
+    add_file(client, name='A', tags=['Rock', 'Live'])
+    add_file(client, name='B', tags=['Rock'])
+    add_file(client, name='C', tags=['Live', 'Jazz'])
+    ids = tag_ids(client)
+
+    names = lambda tags: sorted(f['name'] for f in get_files(client, tags=tags).get_json())
+    assert names([ids['Rock']]) == ['A', 'B']
+    assert names([ids['Rock'], ids['Live']]) == ['A']
+    assert names([ids['Rock'], ids['Rock'], ids['Live']]) == ['A']
+    assert names([ids['Rock'], ids['Jazz']]) == []
+
+
+def test_getfiles_search_matches_literally(client):
+    add_file(client, name='Moonlight Sonata')
+    add_file(client, name='100% Pure')
+
+    assert [f['name'] for f in get_files(client, search='LIGHT').get_json()] == ['Moonlight Sonata']
+    assert [f['name'] for f in get_files(client, search='0%').get_json()] == ['100% Pure']
+    assert get_files(client, search='_').get_json() == []
+
+
+def test_getfiles_statement_count(client, statements):
+    for i in range(5):
+        add_file(client, name=f'Song {i}', tags=[f'tag{i}', 'common'])
+
+    statements.clear()
+    files = get_files(client).get_json()
+    assert len(files) == 5
+    assert all(len(f['tags']) == 2 for f in files)
+    assert len(statements) <= 2
+
+
+def test_gettaglist_conditional_get(client, statements):
+    add_file(client, tags=['Rock'])
+
+    first = client.get('/gettaglist')
+    assert first.status_code == 200
+    assert first.get_json()[0]['tag'] == 'Rock'
+
+    statements.clear()
+    second = client.get('/gettaglist', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.data == b''
+    assert statements == []
+
+    # Proxies that re-encode the body (e.g. gzip) weaken the tag; it must still match
+    weak = client.get('/gettaglist', headers={'If-None-Match': 'W/' + first.headers['ETag']})
+    assert weak.status_code == 304
+
+
+def test_gettaglist_sees_new_tags(client):
+    add_file(client, tags=['Rock'])
+    etag = client.get('/gettaglist').headers['ETag']
+
+    add_file(client, tags=['Jazz'])
+    response = client.get('/gettaglist', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert sorted(t['tag'] for t in response.get_json()) == ['Jazz', 'Rock']
+
+
+def test_tags_use_database_case_folding(client):
+    # Python lowers the final sigma to 'ς', Postgres to 'σ'; both must still resolve
+    assert add_file(client, tags=['Čakavski', 'ΟΔΟΣ']).status_code == 200
+    assert add_file(client, tags=['čakavski', 'οδοσ', 'ΟΔΟΣ']).status_code == 200
+    assert sorted(tag_ids(client)) == ['Čakavski', 'ΟΔΟΣ']
+    assert all(len(f['tags']) == 2 for f in get_files(client).get_json())
+
+
+def test_gettaglist_discards_fill_that_raced_an_invalidation(client, backend, monkeypatch):
+    add_file(client, tags=['Rock'])
+    make_etag = backend.make_etag
+
+    def racing_make_etag(body):
+        # A concurrent upload commits new tags after this request's tag query ran
+        backend.invalidate_tag_cache()
+        return make_etag(body)
+
+    monkeypatch.setattr(backend, 'make_etag', racing_make_etag)
+    assert client.get('/gettaglist').status_code == 200
+    assert backend._tag_cache['entry'] is None
+
+    monkeypatch.setattr(backend, 'make_etag', make_etag)
+    client.get('/gettaglist')
+    assert backend._tag_cache['entry'] is not None
+
+
+def test_getfiles_pages_and_signals_more(client, backend, monkeypatch):
+    monkeypatch.setattr(backend, 'MAX_FILES_PAGE_SIZE', 2)
+    for name in ('A', 'B', 'C'):
+        add_file(client, name=name)
+
+    first = get_files(client)
+    assert [f['name'] for f in first.get_json()] == ['A', 'B']
+    assert first.headers['X-Has-More'] == 'true'
+    assert 'X-Has-More' in first.headers['Access-Control-Expose-Headers']
+
+    last = get_files(client, offset=2, limit=5)
+    assert [f['name'] for f in last.get_json()] == ['C']
+    assert last.headers['X-Has-More'] == 'false'
+
+
+def test_getfiles_rejects_non_integer_page_bounds(client):
+    for bounds in ({'limit': True}, {'limit': 3.7}, {'limit': '10'}, {'limit': 0}, {'offset': -1}, {'offset': 1.0}):
+        assert get_files(client, **bounds).status_code == 400, bounds